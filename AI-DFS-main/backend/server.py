@@ -1,30 +1,54 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import JSONResponse
-from dotenv import load_dotenv
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form, Query, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, InsertOne
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import BulkWriteError
 import os
+import asyncio
+import time
+import re
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone
 import aiofiles
-import mimetypes
-import json
+import aiofiles.os
+import hashlib
+import orjson
 import google.generativeai as genai
 
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+
+class Settings(BaseSettings):
+    """Application config, read once from the environment and .env at import"""
+    model_config = SettingsConfigDict(env_file=ROOT_DIR / '.env', extra='ignore')
+    
+    mongo_url: str
+    db_name: str
+    gemini_api_key: Optional[str] = None
+    cors_origins: str = "*"
+
+settings = Settings()
 
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncMongoClient(
+    settings.mongo_url,
+    maxPoolSize=200,
+    minPoolSize=10,
+    maxIdleTimeMS=300000,
+    serverSelectionTimeoutMS=5000
+)
+db = client[settings.db_name]
+
+# Upload inserts only need acknowledgement from the primary
+file_metadata_writes = db.file_metadata.with_options(write_concern=WriteConcern(w=1))
 
 # Create the main app without a prefix
-app = FastAPI(title="IntelliShare API", description="Smart File Sharing with AI Intelligence", version="1.0")
+app = FastAPI(title="IntelliShare API", description="Smart File Sharing with AI Intelligence", version="1.0", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -33,23 +57,100 @@ api_router = APIRouter(prefix="/api")
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# AI Analysis Service
-class AIAnalysisService:
-    def __init__(self):
-        self.api_key = os.environ.get('GEMINI_API_KEY')
-        genai.configure(api_key=self.api_key)
-        
-    async def analyze_file(self, file_path: str, file_type: str, original_filename: str) -> Dict[str, Any]:
-        """Analyze uploaded file using Gemini AI"""
-        try:
-            model = genai.GenerativeModel('gemini-2.5-pro')
-            
-            # Upload the file to the Gemini API
-            uploaded_file = genai.upload_file(path=file_path)
-            
-            # Analyze based on file type
-            if file_type.startswith('image/'):
-                analysis_prompt = f"""Analyze this image file '{original_filename}' and provide:
+# Uploads are copied to disk in chunks of this size so memory stays flat
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# MIME types for the file extensions we expect to receive
+EXTENSION_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.jpe': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+    '.svg': 'image/svg+xml',
+    '.tiff': 'image/tiff',
+    '.tif': 'image/tiff',
+    '.avif': 'image/avif',
+    '.heic': 'image/heic',
+    '.heif': 'image/heif',
+    '.ico': 'image/vnd.microsoft.icon',
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.csv': 'text/csv',
+    '.tsv': 'text/tab-separated-values',
+    '.md': 'text/markdown',
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+    '.py': 'text/x-python',
+    '.c': 'text/plain',
+    '.h': 'text/plain',
+    '.cpp': 'text/x-c++src',
+    '.java': 'text/x-java',
+    '.pl': 'text/plain',
+    '.sh': 'text/x-sh',
+    '.ksh': 'text/plain',
+    '.bat': 'text/plain',
+    '.tex': 'text/x-tex',
+    '.rtx': 'text/richtext',
+    '.sgml': 'text/x-sgml',
+    '.sgm': 'text/x-sgml',
+    '.srt': 'text/plain',
+    '.vtt': 'text/vtt',
+    '.ics': 'text/calendar',
+    '.vcf': 'text/x-vcard',
+    '.json': 'application/json',
+    '.xml': 'application/xml',
+    '.zip': 'application/zip',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/x-wav',
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+}
+
+# Gemini request throttling: cap in-flight calls and space out their start times
+GEMINI_MAX_CONCURRENCY = 8
+GEMINI_MIN_INTERVAL = 0.1
+_gemini_sem = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+_last_call = 0.0
+
+async def _rate_gate():
+    """Wait until at least GEMINI_MIN_INTERVAL has passed since the previous call"""
+    global _last_call
+    now = time.monotonic()
+    wait = max(0.0, _last_call + GEMINI_MIN_INTERVAL - now)
+    # Reserve our slot before sleeping so concurrent callers queue up behind it
+    _last_call = now + wait
+    if wait:
+        await asyncio.sleep(wait)
+
+# Retry policy for transient Gemini rate-limit / quota errors
+GEMINI_MAX_ATTEMPTS = 3
+GEMINI_BACKOFF_BASE = 1.0
+GEMINI_BACKOFF_MAX = 8.0
+_RATE_LIMIT_PATTERN = re.compile(r"\b429\b|rate.?limit|quota|resource.?exhausted", re.IGNORECASE)
+
+def _is_rate_limit(error: Exception) -> bool:
+    """Check whether an exception looks like a transient rate-limit error"""
+    if getattr(error, 'status_code', None) == 429 or getattr(error, 'code', None) == 429:
+        return True
+    return bool(_RATE_LIMIT_PATTERN.search(str(error)))
+
+# Maximum number of files analyzed at once by /reanalyze, and how many are fetched per page
+REANALYZE_CONCURRENCY = 16
+REANALYZE_PAGE_SIZE = 100
+
+# Gemini analysis prompts, formatted with the original filename
+IMAGE_ANALYSIS_PROMPT = """Analyze this image file '{original_filename}' and provide:
 1. Content classification (what type of image it is)
 2. Visual description (what's in the image)
 3. Key objects or subjects identified
@@ -58,9 +159,8 @@ class AIAnalysisService:
 6. Overall quality assessment
 
 Format your response as JSON with keys: classification, description, key_subjects, tags, text_content, quality."""
-            
-            elif file_type == 'application/pdf' or file_type.startswith('text/'):
-                analysis_prompt = f"""Analyze this document '{original_filename}' and provide:
+
+DOCUMENT_ANALYSIS_PROMPT = """Analyze this document '{original_filename}' and provide:
 1. Document classification (type/category)
 2. Key topics and themes
 3. Summary of main content
@@ -69,9 +169,8 @@ Format your response as JSON with keys: classification, description, key_subject
 6. Readability and language analysis
 
 Format your response as JSON with keys: classification, key_topics, summary, entities, tags, language_analysis."""
-            
-            else:
-                analysis_prompt = f"""Analyze this file '{original_filename}' and provide:
+
+FILE_ANALYSIS_PROMPT = """Analyze this file '{original_filename}' and provide:
 1. File classification and type
 2. Key information extracted
 3. Summary of content
@@ -80,15 +179,51 @@ Format your response as JSON with keys: classification, key_topics, summary, ent
 
 Format your response as JSON with keys: classification, key_info, summary, tags, metadata."""
 
+# AI Analysis Service
+class AIAnalysisService:
+    def __init__(self):
+        self.api_key = settings.gemini_api_key
+        genai.configure(api_key=self.api_key)
+        self.model = genai.GenerativeModel('gemini-2.5-pro')
+    
+    async def _call_gemini(self, func, *args, **kwargs):
+        """Run a blocking Gemini SDK call, retrying rate-limit errors with exponential backoff"""
+        for attempt in range(GEMINI_MAX_ATTEMPTS):
+            try:
+                async with _gemini_sem:
+                    await _rate_gate()
+                    return await asyncio.to_thread(func, *args, **kwargs)
+            except Exception as e:
+                if _is_rate_limit(e) and attempt < GEMINI_MAX_ATTEMPTS - 1:
+                    delay = min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt)
+                    logging.warning(f"Gemini rate limited, retrying in {delay}s: {str(e)}")
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+        
+    async def analyze_file(self, file_path: str, file_type: str, original_filename: str) -> Dict[str, Any]:
+        """Analyze uploaded file using Gemini AI"""
+        try:
+            # Analyze based on file type
+            if file_type.startswith('image/'):
+                analysis_prompt = IMAGE_ANALYSIS_PROMPT.format(original_filename=original_filename)
+            elif file_type == 'application/pdf' or file_type.startswith('text/'):
+                analysis_prompt = DOCUMENT_ANALYSIS_PROMPT.format(original_filename=original_filename)
+            else:
+                analysis_prompt = FILE_ANALYSIS_PROMPT.format(original_filename=original_filename)
+
+            # Upload the file to the Gemini API
+            uploaded_file = await self._call_gemini(genai.upload_file, path=file_path)
+            
             # Send analysis request
-            response = model.generate_content([analysis_prompt, uploaded_file])
+            response = await self._call_gemini(self.model.generate_content, [analysis_prompt, uploaded_file])
             response = response.text
             
             # Parse AI response
             try:
                 # Try to extract JSON from response
-                ai_analysis = json.loads(response)
-            except json.JSONDecodeError:
+                ai_analysis = orjson.loads(response)
+            except orjson.JSONDecodeError:
                 # If not valid JSON, create structured response
                 ai_analysis = {
                     "classification": "Unknown",
@@ -119,6 +254,9 @@ Format your response as JSON with keys: classification, key_info, summary, tags,
 
 ai_service = AIAnalysisService()
 
+# Largest page list endpoints will return in one request
+MAX_PAGE_SIZE = 500
+
 # Define Models
 class FileMetadata(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -127,23 +265,27 @@ class FileMetadata(BaseModel):
     file_path: str
     file_size: int
     file_type: str
+    content_hash: Optional[str] = None
     upload_timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     ai_analysis: Dict[str, Any] = Field(default_factory=dict)
     tags: List[str] = Field(default_factory=list)
+    user_tags: List[str] = Field(default_factory=list)
     is_public: bool = False
     uploaded_by: Optional[str] = None
 
 class FileUploadResponse(BaseModel):
     success: bool
-    file_id: str
+    file_id: Optional[str] = None
     filename: str
-    ai_analysis: Dict[str, Any]
+    ai_analysis: Dict[str, Any] = Field(default_factory=dict)
     message: str
 
 class FileSearchRequest(BaseModel):
     query: str
     tags: Optional[List[str]] = None
     file_types: Optional[List[str]] = None
+    skip: int = Field(0, ge=0)
+    limit: int = Field(100, ge=1, le=MAX_PAGE_SIZE)
 
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -153,6 +295,9 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+# Fields list endpoints don't need: server-side paths and the raw Gemini reply
+LIST_PROJECTION = {"_id": 0, "stored_filename": 0, "file_path": 0, "ai_analysis.raw_response": 0}
+
 # Helper functions
 def prepare_for_mongo(data):
     """Convert datetime objects to ISO strings for MongoDB storage"""
@@ -160,6 +305,10 @@ def prepare_for_mongo(data):
         data['upload_timestamp'] = data['upload_timestamp'].isoformat()
     return data
 
+def parse_tags(tags: str) -> List[str]:
+    """Split a comma-separated tag string into a list of tags"""
+    return [tag.strip() for tag in tags.split(',') if tag.strip()] if tags else []
+
 def parse_from_mongo(item):
     """Parse datetime strings back from MongoDB"""
     if isinstance(item.get('upload_timestamp'), str):
@@ -171,6 +320,82 @@ def parse_from_mongo(item):
 async def root():
     return {"message": "IntelliShare API - Smart File Sharing with AI Intelligence", "version": "1.0", "status": "active"}
 
+async def store_upload(file: UploadFile, tag_list: List[str], is_public: bool) -> FileMetadata:
+    """Save an upload to disk, analyze it and build its metadata"""
+    # Generate unique filename
+    file_extension = os.path.splitext(file.filename)[1]
+    stored_filename = f"{uuid.uuid4()}{file_extension}"
+    file_path = UPLOAD_DIR / stored_filename
+    
+    try:
+        # Stream file to disk chunk by chunk, hashing as we go
+        file_size = 0
+        content_hash = hashlib.blake2b(digest_size=16)
+        async with aiofiles.open(file_path, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                content_hash.update(chunk)
+                file_size += len(chunk)
+        content_hash = content_hash.hexdigest()
+        
+        # Reuse the stored copy and analysis of an identical, successfully analyzed upload
+        existing = await db.file_metadata.find_one(
+            {"content_hash": content_hash, "ai_analysis.error": {"$exists": False}},
+            {"_id": 0, "stored_filename": 1, "file_path": 1, "ai_analysis": 1}
+        )
+    except Exception:
+        # Don't leave a partial file behind
+        if file_path.exists():
+            await aiofiles.os.remove(file_path)
+        raise
+    
+    # Get file info
+    file_type = EXTENSION_MIME_TYPES.get(file_extension.lower(), 'application/octet-stream')
+    
+    if existing and Path(existing["file_path"]).exists():
+        await aiofiles.os.remove(file_path)
+        stored_filename = existing["stored_filename"]
+        file_path = existing["file_path"]
+        ai_analysis = existing["ai_analysis"]
+    else:
+        # AI Analysis
+        ai_analysis = await ai_service.analyze_file(str(file_path), file_type, file.filename)
+    
+    # Merge AI tags with user tags
+    ai_tags = ai_analysis.get('tags', [])
+    all_tags = list(dict.fromkeys(tag_list + ai_tags))
+    
+    # Create file metadata
+    return FileMetadata(
+        original_filename=file.filename,
+        stored_filename=stored_filename,
+        file_path=str(file_path),
+        file_size=file_size,
+        file_type=file_type,
+        content_hash=content_hash,
+        ai_analysis=ai_analysis,
+        tags=all_tags,
+        user_tags=tag_list,
+        is_public=is_public
+    )
+
+async def discard_upload(file_metadata: FileMetadata):
+    """Delete the stored file of an upload whose metadata was never saved"""
+    # Deduplicated uploads share their file with an existing record
+    if await db.file_metadata.count_documents({"file_path": file_metadata.file_path}, limit=1):
+        return
+    if Path(file_metadata.file_path).exists():
+        await aiofiles.os.remove(file_metadata.file_path)
+
+def upload_response(file_metadata: FileMetadata) -> FileUploadResponse:
+    return FileUploadResponse(
+        success=True,
+        file_id=file_metadata.id,
+        filename=file_metadata.original_filename,
+        ai_analysis=file_metadata.ai_analysis,
+        message="File uploaded and analyzed successfully"
+    )
+
 @api_router.post("/upload", response_model=FileUploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
@@ -183,67 +408,111 @@ async def upload_file(
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file provided")
         
-        # Generate unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        stored_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = UPLOAD_DIR / stored_filename
-        
-        # Save file
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        file_metadata = await store_upload(file, parse_tags(tags), is_public)
         
-        # Get file info
-        file_size = len(content)
-        file_type = mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+        # Store in database
+        metadata_dict = prepare_for_mongo(file_metadata.dict())
+        try:
+            await file_metadata_writes.insert_one(metadata_dict)
+        except Exception:
+            await discard_upload(file_metadata)
+            raise
         
-        # Parse tags
-        tag_list = [tag.strip() for tag in tags.split(',') if tag.strip()] if tags else []
+        return upload_response(file_metadata)
         
-        # AI Analysis
-        ai_analysis = await ai_service.analyze_file(str(file_path), file_type, file.filename)
-        
-        # Merge AI tags with user tags
-        ai_tags = ai_analysis.get('tags', [])
-        all_tags = list(set(tag_list + ai_tags))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Upload error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+@api_router.post("/upload/batch", response_model=List[FileUploadResponse])
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    is_public: bool = Form(default=False),
+    tags: str = Form(default="")
+):
+    """Upload and analyze several files, storing their metadata in one bulk write"""
+    try:
+        # Validate files
+        if not files or any(not file.filename for file in files):
+            raise HTTPException(status_code=400, detail="No file provided")
         
-        # Create file metadata
-        file_metadata = FileMetadata(
-            original_filename=file.filename,
-            stored_filename=stored_filename,
-            file_path=str(file_path),
-            file_size=file_size,
-            file_type=file_type,
-            ai_analysis=ai_analysis,
-            tags=all_tags,
-            is_public=is_public
+        tag_list = parse_tags(tags)
+        # Each file succeeds or fails on its own; store_upload cleans up after itself on error
+        results = await asyncio.gather(
+            *(store_upload(file, tag_list, is_public) for file in files),
+            return_exceptions=True
         )
+        uploads = [result for result in results if isinstance(result, FileMetadata)]
         
         # Store in database
-        metadata_dict = prepare_for_mongo(file_metadata.dict())
-        result = await db.file_metadata.insert_one(metadata_dict)
+        failed_inserts = {}
+        if uploads:
+            ops = [InsertOne(prepare_for_mongo(file_metadata.dict())) for file_metadata in uploads]
+            try:
+                await file_metadata_writes.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                failed_inserts = {error["index"]: error["errmsg"] for error in e.details.get("writeErrors", [])}
+            except Exception:
+                for file_metadata in uploads:
+                    await discard_upload(file_metadata)
+                raise
         
-        return FileUploadResponse(
-            success=True,
-            file_id=file_metadata.id,
-            filename=file.filename,
-            ai_analysis=ai_analysis,
-            message="File uploaded and analyzed successfully"
-        )
+        # Report per file, in the order the files were sent
+        responses = []
+        upload_index = 0
+        for file, result in zip(files, results):
+            if isinstance(result, BaseException):
+                logging.error(f"Batch upload error for {file.filename}: {str(result)}")
+                responses.append(FileUploadResponse(
+                    success=False, filename=file.filename, message=f"Upload failed: {str(result)}"
+                ))
+                continue
+            
+            if upload_index in failed_inserts:
+                logging.error(f"Batch insert error for {file.filename}: {failed_inserts[upload_index]}")
+                await discard_upload(result)
+                responses.append(FileUploadResponse(
+                    success=False, filename=file.filename, message=f"Upload failed: {failed_inserts[upload_index]}"
+                ))
+            else:
+                responses.append(upload_response(result))
+            upload_index += 1
         
+        return responses
+        
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Upload error: {str(e)}")
+        logging.error(f"Batch upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@api_router.get("/files", response_model=List[FileMetadata])
-async def get_files(skip: int = 0, limit: int = 50):
-    """Get all uploaded files with AI analysis"""
+@api_router.get("/files", response_class=StreamingResponse)
+async def get_files(skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
+    """Stream uploaded files with AI analysis as NDJSON, one file per line"""
     try:
-        files = await db.file_metadata.find().skip(skip).limit(limit).to_list(length=None)
-        return [FileMetadata(**parse_from_mongo(file)) for file in files]
+        cursor = db.file_metadata.find({}, LIST_PROJECTION).skip(skip).limit(limit).batch_size(100)
+        # Run the query before the response starts, so a database failure can still be a 500
+        files = cursor.__aiter__()
+        first = await anext(files, None)
     except Exception as e:
         logging.error(f"Error fetching files: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch files")
+    
+    async def stream_files():
+        if first is None:
+            return
+        yield orjson.dumps(first) + b"\n"
+        try:
+            async for file_data in files:
+                yield orjson.dumps(file_data) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so all we can do is log and cut the stream short
+            logging.error(f"Error fetching files: {str(e)}")
+            raise
+    
+    return StreamingResponse(stream_files(), media_type="application/x-ndjson")
 
 @api_router.get("/files/{file_id}", response_model=FileMetadata)
 async def get_file(file_id: str):
@@ -259,63 +528,184 @@ async def get_file(file_id: str):
         logging.error(f"Error fetching file {file_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch file")
 
-@api_router.post("/search")
+@api_router.post("/search", response_class=ORJSONResponse)
 async def search_files(search_request: FileSearchRequest):
     """Search files using AI-generated tags and summaries"""
     try:
-        query = {}
-        
-        # Build search query
-        search_conditions = []
-        
-        if search_request.query:
-            # Search in filename, tags, AI analysis
-            search_text = {"$regex": search_request.query, "$options": "i"}
-            search_conditions.extend([
-                {"original_filename": search_text},
-                {"tags": search_text},
-                {"ai_analysis.classification": search_text},
-                {"ai_analysis.summary": search_text},
-                {"ai_analysis.key_topics": search_text}
-            ])
+        # Build filter conditions
+        filters = []
         
         if search_request.tags:
-            search_conditions.append({"tags": {"$in": search_request.tags}})
+            filters.append({"tags": {"$in": search_request.tags}})
         
         if search_request.file_types:
-            search_conditions.append({"file_type": {"$in": search_request.file_types}})
+            filters.append({"file_type": {"$in": search_request.file_types}})
+        
+        search_text = search_request.query.strip()
+        sort = None
         
-        if search_conditions:
-            query["$or"] = search_conditions
+        if not search_text:
+            conditions = filters
+        else:
+            # A single word is most likely a tag: use the tags index if any file matches it.
+            # The mode is picked without skip so every page of a search uses the same query.
+            conditions = [{"tags": search_text}] + filters
+            is_tag_search = len(search_text.split()) == 1 and await db.file_metadata.find_one(
+                {"$and": conditions}, {"_id": 1}
+            )
+            if not is_tag_search:
+                # Search in filename, tags, AI analysis via the text index, best matches first
+                conditions = [{"$text": {"$search": search_text}}] + filters
+                sort = [("score", {"$meta": "textScore"})]
         
-        files = await db.file_metadata.find(query).to_list(length=100)
-        return [FileMetadata(**parse_from_mongo(file)) for file in files]
+        query = {"$and": conditions} if conditions else {}
+        cursor = db.file_metadata.find(query, LIST_PROJECTION)
+        if sort:
+            cursor = cursor.sort(sort)
+        cursor = cursor.skip(search_request.skip).limit(search_request.limit)
+        files = await cursor.to_list(length=search_request.limit)
+        
+        # Stored documents are already JSON-ready (timestamps are ISO strings), so skip model validation
+        return ORJSONResponse(files)
         
     except Exception as e:
         logging.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail="Search failed")
 
+async def run_reanalysis(job_id: str, only_failed: bool):
+    """Re-run AI analysis over stored files, recording progress on the job document"""
+    query = {"tags": "analysis-failed"} if only_failed else {}
+    # Acquired before each task is created, so at most this many are in flight
+    slots = asyncio.Semaphore(REANALYZE_CONCURRENCY)
+    updated = 0
+    failed = 0
+    
+    async def reanalyze(file_data):
+        nonlocal updated, failed
+        try:
+            ai_analysis = await ai_service.analyze_file(
+                file_data["file_path"], file_data["file_type"], file_data["original_filename"]
+            )
+            old_analysis = file_data.get("ai_analysis", {})
+            if "error" in ai_analysis:
+                failed += 1
+                # Never replace a good analysis with a failure record
+                if "error" not in old_analysis:
+                    return
+            # Rebuild tags from the user's own tags plus the new AI tags
+            user_tags = file_data.get("user_tags")
+            if user_tags is None:
+                # Records from before user_tags was stored: best guess is whatever the AI didn't suggest
+                old_ai_tags = set(old_analysis.get("tags", []))
+                user_tags = [tag for tag in file_data.get("tags", []) if tag not in old_ai_tags]
+            all_tags = list(dict.fromkeys(user_tags + ai_analysis.get("tags", [])))
+            await db.file_metadata.update_one(
+                {"id": file_data["id"]},
+                {"$set": {"ai_analysis": ai_analysis, "tags": all_tags, "user_tags": user_tags}}
+            )
+            if "error" not in ai_analysis:
+                updated += 1
+        except Exception as e:
+            # One bad record mustn't take down the TaskGroup and the rest of the backfill
+            logging.error(f"Reanalysis error for file {file_data.get('id')}: {str(e)}")
+            failed += 1
+        finally:
+            slots.release()
+    
+    # Anything short of a clean finish, including cancellation at shutdown, leaves the job failed
+    status = "failed"
+    try:
+        projection = {"_id": 0, "id": 1, "file_path": 1, "file_type": 1, "original_filename": 1, "tags": 1, "user_tags": 1, "ai_analysis.tags": 1, "ai_analysis.error": 1}
+        last_id = None
+        async with asyncio.TaskGroup() as tg:
+            while True:
+                # Page by id with a fresh short-lived query, so no cursor sits idle while Gemini works
+                page_query = {**query, "id": {"$gt": last_id}} if last_id else query
+                page = await db.file_metadata.find(page_query, projection).sort("id", 1).limit(REANALYZE_PAGE_SIZE).to_list(length=REANALYZE_PAGE_SIZE)
+                if not page:
+                    break
+                last_id = page[-1]["id"]
+                
+                for file_data in page:
+                    if not Path(file_data["file_path"]).exists():
+                        continue
+                    await slots.acquire()
+                    tg.create_task(reanalyze(file_data))
+                
+                await db.reanalysis_jobs.update_one({"id": job_id}, {"$set": {"updated": updated, "failed": failed}})
+        
+        status = "completed"
+    except Exception as e:
+        logging.error(f"Reanalysis error: {str(e)}")
+    finally:
+        await db.reanalysis_jobs.update_one(
+            {"id": job_id},
+            {"$set": {
+                "status": status,
+                "updated": updated,
+                "failed": failed,
+                "finished_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+
+@api_router.post("/reanalyze", status_code=202)
+async def reanalyze_files(background_tasks: BackgroundTasks, only_failed: bool = False):
+    """Start re-running AI analysis over stored files, e.g. to backfill failed analyses"""
+    try:
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": "running",
+            "only_failed": only_failed,
+            "updated": 0,
+            "failed": 0,
+            "started_at": datetime.now(timezone.utc).isoformat()
+        }
+        await db.reanalysis_jobs.insert_one(dict(job))
+        background_tasks.add_task(run_reanalysis, job["id"], only_failed)
+        return job
+        
+    except Exception as e:
+        logging.error(f"Reanalysis error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to start reanalysis")
+
+@api_router.get("/reanalyze/{job_id}")
+async def get_reanalysis_job(job_id: str):
+    """Get progress of a reanalysis job"""
+    try:
+        job = await db.reanalysis_jobs.find_one({"id": job_id}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Reanalysis job not found")
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching reanalysis job {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch reanalysis job")
+
 @api_router.get("/analytics")
 async def get_analytics():
     """Get platform analytics"""
     try:
-        total_files = await db.file_metadata.count_documents({})
-        
-        # Get file type distribution
+        # Count, file type distribution and most common tags in one round-trip
         pipeline = [
-            {"$group": {"_id": "$file_type", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "file_types": [
+                    {"$group": {"_id": "$file_type", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}}
+                ],
+                "top_tags": [
+                    {"$unwind": "$tags"},
+                    {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1}},
+                    {"$limit": 20}
+                ]
+            }}
         ]
-        file_types = await db.file_metadata.aggregate(pipeline).to_list(length=None)
-        
-        # Get most common tags
-        pipeline = [
-            {"$unwind": "$tags"},
-            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 20}
-        ]
-        top_tags = await db.file_metadata.aggregate(pipeline).to_list(length=None)
+        result = (await (await db.file_metadata.aggregate(pipeline)).to_list(length=1))[0]
+        total_files = result["total"][0]["n"] if result["total"] else 0
+        file_types = result["file_types"]
+        top_tags = result["top_tags"]
         
         return {
             "total_files": total_files,
@@ -347,7 +737,7 @@ app.include_router(api_router)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_origins=settings.cors_origins.split(','),
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -359,6 +749,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    # Open the connection pool before the first request arrives
+    await db.command("ping")
+    
+    # get_file looks documents up by our uuid id rather than Mongo's _id
+    await db.file_metadata.create_index("id", unique=True)
+    
+    # Lets uploads find an identical existing file by content
+    await db.file_metadata.create_index("content_hash")
+    
+    # Text index backing /search, plus indexes for its tag and type filters
+    await db.file_metadata.create_index([
+        ("original_filename", "text"),
+        ("tags", "text"),
+        ("ai_analysis.classification", "text"),
+        ("ai_analysis.summary", "text"),
+        ("ai_analysis.key_topics", "text")
+    ], name="file_search_text")
+    await db.file_metadata.create_index("tags")
+    await db.file_metadata.create_index("file_type")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await client.close()
\ No newline at end of file
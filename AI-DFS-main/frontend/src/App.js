@@ -357,8 +357,9 @@ function App() {
 
   const loadFiles = async () => {
     try {
-      const response = await axios.get(`${API}/files`);
-      setFiles(response.data);
+      // The files listing is NDJSON: one JSON document per line
+      const response = await axios.get(`${API}/files`, { responseType: 'text' });
+      setFiles(response.data.split('\n').filter(line => line.trim()).map(line => JSON.parse(line)));
     } catch (error) {
       console.error('Failed to load files:', error);
     } finally {